@@ -1,10 +1,16 @@
 import streamlit as st
-import pandas as pd
 import numpy as np
-import pickle
+import collections
+import hashlib
+import hmac
 import json
 import os
-import plotly.graph_objects as go
+import re
+import secrets
+import threading
+import time
+import onnxruntime as ort
+import orjson
 from datetime import datetime
 
 # --- 1. PAGE SETUP (Must be the first Streamlit command) ---
@@ -13,44 +19,56 @@ st.set_page_config(page_title="SeismicGuard Pro", page_icon="🌋", layout="wide
 # --- 2. USER DATA MANAGEMENT ---
 USER_DB = "users.json"
 
+def hash_password(password, salt=None):
+    # Stored as "salt$sha256(salt + password)" with a fresh salt per user
+    if salt is None:
+        salt = secrets.token_hex(16)
+    return f"{salt}${hashlib.sha256((salt + password).encode()).hexdigest()}"
+
+def is_hashed(stored):
+    return re.fullmatch(r"[0-9a-f]{32}\$[0-9a-f]{64}", stored) is not None
+
+def check_password(stored, password):
+    salt = stored.split("$", 1)[0]
+    return hmac.compare_digest(stored.encode(), hash_password(password, salt).encode())
+
+@st.cache_resource
 def load_users():
+    # Parsed once per process; save_user updates this same dict in place
     if not os.path.exists(USER_DB):
-        return {"admin": "seismic2024"} # Default admin
-    with open(USER_DB, "r") as f:
-        return json.load(f)
+        return {"admin": hash_password("seismic2024")} # Default admin
+    with open(USER_DB, "rb") as f:
+        return orjson.loads(f.read())
+
+def write_users(users):
+    with open(USER_DB, "wb") as f:
+        f.write(orjson.dumps(users))
 
 def save_user(username, password):
     users = load_users()
     if username in users: return False
-    users[username] = password
-    with open(USER_DB, "w") as f:
-        json.dump(users, f)
+    users[username] = hash_password(password) # Mutates the cached dict, no re-read needed
+    write_users(users)
+    return True
+
+def verify_user(username, password):
+    users = load_users()
+    stored = users.get(username)
+    if stored is None:
+        return False
+    if is_hashed(stored):
+        return check_password(stored, password)
+    # Plaintext entry saved before passwords were hashed; upgrade it on a good login
+    if not hmac.compare_digest(stored.encode(), password.encode()):
+        return False
+    users[username] = hash_password(password)
+    write_users(users)
     return True
 
 # --- 3. CUSTOM CSS FOR A REAL WEBSITE LOOK ---
-st.markdown("""
-    <style>
-    .stApp { background-color: #0e1117; color: #ffffff; }
-    .prediction-card {
-        padding: 40px;
-        border-radius: 20px;
-        text-align: center;
-        box-shadow: 0 10px 30px rgba(0,0,0,0.5);
-        border: 1px solid rgba(255,255,255,0.1);
-        margin-bottom: 20px;
-    }
-    .main-title { 
-        font-size: 3rem; 
-        font-weight: 800; 
-        text-align: center;
-        background: linear-gradient(45deg, #ff4b4b, #00d4ff); 
-        -webkit-background-clip: text; 
-        -webkit-text-fill-color: transparent;
-        margin-bottom: 20px;
-    }
-    div[data-testid="stExpander"] { background-color: #161b22; border-radius: 10px; }
-    </style>
-""", unsafe_allow_html=True)
+# The stylesheet lives in static/site.css (served via enableStaticServing), so each
+# rerun only sends this link tag and the browser caches the CSS itself.
+st.markdown('<link rel="stylesheet" href="app/static/site.css">', unsafe_allow_html=True)
 
 # --- 4. SESSION STATE INITIALIZATION ---
 if 'logged_in' not in st.session_state:
@@ -58,25 +76,90 @@ if 'logged_in' not in st.session_state:
 if 'user' not in st.session_state:
     st.session_state['user'] = None
 if 'history' not in st.session_state:
-    st.session_state['history'] = []
+    # One bounded deque of (Time, Magnitude, Level) rows, newest first. Every
+    # change to it is a single deque call, so the guard thread below can trim it
+    # without ever splitting a row.
+    st.session_state['history'] = collections.deque(maxlen=200)
+
+HISTORY_COLUMNS = ("Time", "Magnitude", "Level")
+
+# Streamlit keeps the state of closed tabs around for a while, so when the process
+# crosses this RSS every session it still holds is cut back to its newest rows
+HISTORY_RSS_LIMIT_MB = 512
+HISTORY_TRIM_TO = 50
+
+@st.cache_resource
+def _gc_guard():
+    # Started once per process as a daemon thread
+    import psutil
+    from streamlit.runtime import Runtime
+
+    def loop():
+        proc = psutil.Process()
+        over_limit = False
+        while True:
+            time.sleep(30)
+            was_over, over_limit = over_limit, proc.memory_info().rss >= HISTORY_RSS_LIMIT_MB * 1024 * 1024
+            # Only trim when RSS goes from below the limit to above it; trimming
+            # again while it stays high would just keep capping live sessions
+            if not over_limit or was_over or not Runtime.exists():
+                continue
+            # list_sessions() includes disconnected sessions, i.e. abandoned tabs
+            for info in Runtime.instance()._session_mgr.list_sessions():
+                state = info.session.session_state
+                if 'history' not in state:
+                    continue
+                history = state['history']
+                # Newest rows are on the left, so drop from the right
+                while len(history) > HISTORY_TRIM_TO:
+                    history.pop()
+
+    threading.Thread(target=loop, daemon=True).start()
+
+_gc_guard()
 
 # --- 5. LOAD AI MODELS ---
+# Column order of the rows passed to the model (see _infer)
+FEATURE_ORDER = ("magnitude", "depth", "cdi", "mmi", "sig")
+
 @st.cache_resource
 def load_assets():
     try:
         # These paths must match your folder structure
-        with open('output/final_model.pkl', 'rb') as f:
-            model = pickle.load(f)
-        with open('output/scaler.pkl', 'rb') as f:
-            scaler = pickle.load(f)
-        with open('output/feature_names.pkl', 'rb') as f:
-            feat_names = pickle.load(f)
-        return model, scaler, feat_names
+        # One row through the tree ensemble is too little work to fan out, so run it
+        # on the calling thread instead of waking (and spinning) ORT's thread pool
+        opts = ort.SessionOptions()
+        opts.intra_op_num_threads = 1
+        opts.inter_op_num_threads = 1
+        opts.add_session_config_entry('session.intra_op.allow_spinning', '0')
+        sess = ort.InferenceSession('output/final_model.onnx', opts, providers=['CPUExecutionProvider'])
+        # Newer exports record their feature order in the model metadata; check it
+        # matches the column order _infer builds. Older exports just skip the check.
+        feat_names = sess.get_modelmeta().custom_metadata_map.get('feature_names')
+        if feat_names is not None and tuple(json.loads(feat_names)) != FEATURE_ORDER:
+            raise ValueError(f"model expects features {feat_names}, app sends {json.dumps(FEATURE_ORDER)}")
+        # Kept as float64: scaling in float32 moves some inputs across tree thresholds
+        with np.load('output/scaler.npz') as arrs:
+            mean, scale = arrs['mean'], arrs['scale']
+        return sess, mean, scale
     except Exception as e:
         st.error(f"Error loading model files: {e}")
         return None, None, None
 
-model, scaler, feature_names = load_assets()
+model, mean, scale = load_assets()
+
+def _infer_batch(X):
+    # X is an (N, 5) array of raw inputs; standardize in float64 like sklearn,
+    # then ONNX Runtime scores all rows in one call
+    scaled = ((X - mean) / scale).astype(np.float32)
+    labels, probs = model.run(None, {'x': scaled})
+    return labels, probs
+
+@st.cache_data(max_entries=1024)
+def _infer(mag, dep, cdi, mmi, sig):
+    # Keyed on the raw inputs, so reruns with unchanged values skip the model
+    labels, probs = _infer_batch(np.array([[mag, dep, cdi, mmi, sig]], dtype=np.float64))
+    return int(labels[0]), probs[0]
 
 # --- 6. LOGIN & REGISTRATION PAGE ---
 def auth_page():
@@ -91,8 +174,7 @@ def auth_page():
             user = st.text_input("Username", key="login_user")
             pw = st.text_input("Password", type="password", key="login_pw")
             if st.button("Sign In", use_container_width=True, type="primary"):
-                users = load_users()
-                if user in users and users[user] == pw:
+                if verify_user(user, pw):
                     st.session_state['logged_in'] = True
                     st.session_state['user'] = user
                     st.rerun()
@@ -112,6 +194,26 @@ def auth_page():
                     st.warning("Please enter both username and password.")
 
 # --- 7. MAIN DASHBOARD PAGE ---
+# UI Mapping (indexed by the model's predicted class)
+LEVELS = ("LOW", "MEDIUM", "HIGH", "CRITICAL")
+COLORS = ("#28a745", "#ffc107", "#fd7e14", "#dc3545")
+DESCRIPTIONS = (
+    "Minor shaking. No damage reported. Routine monitoring.",
+    "Moderate shaking. Potential minor damage to old buildings.",
+    "Severe shaking. Structural damage likely. High alert.",
+    "Disastrous impact. Extreme damage expected. Emergency response active."
+)
+
+@st.cache_resource
+def _gauge_template():
+    # Built once per process from static/gauge.json; the lock keeps concurrent
+    # sessions from patching the shared figure while another one is rendering it.
+    # plotly is imported here so the login page never pays for it.
+    import plotly.graph_objects as go
+    with open('static/gauge.json', 'r') as f:
+        fig = go.Figure(json.load(f))
+    return fig, threading.Lock()
+
 def main_dashboard():
     # Sidebar Navigation
     st.sidebar.markdown(f"### 🛡️ System Access: {st.session_state['user'].upper()}")
@@ -124,8 +226,8 @@ def main_dashboard():
     if nav == "Prediction Center":
         st.markdown('<p class="main-title">Seismic Impact Intelligence</p>', unsafe_allow_html=True)
         
-        # Input Section
-        with st.container(border=True):
+        # Input Section (a form, so edits only rerun the script on submit)
+        with st.form("seismic_inputs", border=True):
             st.subheader("⌨️ Seismic Parameter Input")
             c1, c2, c3 = st.columns(3)
             mag = c1.number_input("Magnitude (Richter)", 0.0, 10.0, 7.2)
@@ -134,7 +236,7 @@ def main_dashboard():
             cdi = c2.number_input("CDI Intensity", 1.0, 12.0, 7.5)
             sig = c3.number_input("Significance Score", 0, 1000, 600)
             st.write("")
-            analyze = st.button("🚀 RUN AI ANALYSIS", use_container_width=True, type="primary")
+            analyze = st.form_submit_button("🚀 RUN AI ANALYSIS", use_container_width=True, type="primary")
 
         if analyze:
             if model is None:
@@ -142,63 +244,48 @@ def main_dashboard():
                 return
 
             # ML Logic
-            input_df = pd.DataFrame([[mag, dep, cdi, mmi, sig]], columns=feature_names)
-            scaled = scaler.transform(input_df)
-            pred_idx = model.predict(scaled)[0]
-            probs = model.predict_proba(scaled)[0]
-
-            # UI Mapping
-            levels = ["LOW", "MEDIUM", "HIGH", "CRITICAL"]
-            colors = ["#28a745", "#ffc107", "#fd7e14", "#dc3545"]
-            descriptions = [
-                "Minor shaking. No damage reported. Routine monitoring.",
-                "Moderate shaking. Potential minor damage to old buildings.",
-                "Severe shaking. Structural damage likely. High alert.",
-                "Disastrous impact. Extreme damage expected. Emergency response active."
-            ]
-            
+            # Reuse this session's last result when the inputs haven't changed,
+            # so even the _infer cache lookup is skipped
+            key = (mag, dep, cdi, mmi, sig)
+            cached = st.session_state.get('_last')
+            if cached and cached[0] == key:
+                pred_idx, probs = cached[1], cached[2]
+            else:
+                pred_idx, probs = _infer(*key)
+                st.session_state['_last'] = (key, pred_idx, probs)
+
             # Save to history
-            st.session_state['history'].insert(0, {
-                "Time": datetime.now().strftime("%H:%M:%S"),
-                "Magnitude": mag,
-                "Level": levels[pred_idx]
-            })
+            st.session_state['history'].appendleft((datetime.now().strftime("%H:%M:%S"), mag, LEVELS[pred_idx]))
 
             # RESULTS UI
             st.markdown("---")
             res_col1, res_col2 = st.columns([1.5, 1])
             
             with res_col1:
-                st.markdown(f"""
-                    <div class="prediction-card" style="background-color:{colors[pred_idx]};">
-                        <p style="margin:0; text-transform:uppercase; font-weight:bold; opacity:0.8;">Predicted Impact Level</p>
-                        <h1 style="font-size:5.5rem; margin:10px 0; font-weight:900; line-height:1;">{levels[pred_idx]}</h1>
-                        <h3 style="margin-top:0; opacity:0.9;">{descriptions[pred_idx]}</h3>
-                        <hr style="border:0.5px solid rgba(255,255,255,0.3)">
-                        <p style="font-size:1.3rem;">AI Confidence Score: <b>{probs[pred_idx]*100:.1f}%</b></p>
-                    </div>
-                """, unsafe_allow_html=True)
+                # Native components; the card color comes from the st-key-card-<level>
+                # rules in static/site.css
+                with st.container(border=True, key=f"card-{LEVELS[pred_idx].lower()}"):
+                    st.caption("PREDICTED IMPACT LEVEL")
+                    st.markdown(f"# {LEVELS[pred_idx]}")
+                    st.markdown(f"### {DESCRIPTIONS[pred_idx]}")
+                    st.divider()
+                    st.metric("AI Confidence Score", f"{probs[pred_idx]*100:.1f}%")
 
             with res_col2:
-                # Gauge Chart
-                fig = go.Figure(go.Indicator(
-                    mode = "gauge+number",
-                    value = probs[pred_idx] * 100,
-                    title = {'text': "Confidence Gauge", 'font': {'size': 20, 'color': "white"}},
-                    gauge = {
-                        'axis': {'range': [0, 100], 'tickcolor': "white"},
-                        'bar': {'color': "white"},
-                        'bgcolor': "rgba(0,0,0,0.1)",
-                        'steps': [{'range': [0, 100], 'color': colors[pred_idx]}]
-                    }
-                ))
-                fig.update_layout(height=300, margin=dict(t=50, b=0, l=10, r=10), paper_bgcolor='rgba(0,0,0,0)', font={'color': "white"})
-                st.plotly_chart(fig, use_container_width=True)
+                # Gauge Chart (shared template, only value and color change per click)
+                fig, fig_lock = _gauge_template()
+                with fig_lock:
+                    fig.data[0].value = float(probs[pred_idx]) * 100
+                    fig.data[0].gauge.steps[0].color = COLORS[pred_idx]
+                    st.plotly_chart(fig, use_container_width=True)
 
     elif nav == "Analysis History":
         st.title("📜 Past Event Analysis")
-        if st.session_state['history']:
-            st.dataframe(pd.DataFrame(st.session_state['history']), use_container_width=True)
+        # copy() snapshots the deque in one call, so a concurrent trim can't
+        # change it while the columns are being built
+        rows = st.session_state['history'].copy()
+        if rows:
+            st.dataframe({col: [row[i] for row in rows] for i, col in enumerate(HISTORY_COLUMNS)}, use_container_width=True)
         else:
             st.info("No records found in current session.")
 